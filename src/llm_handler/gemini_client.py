@@ -5,6 +5,7 @@ from src.config.settings import settings
 from langchain_community.chat_message_histories import SQLChatMessageHistory
 from loguru import logger
 import sqlite3
+import hashlib
 from pydantic import BaseModel
 import re
 import datetime
@@ -14,6 +15,19 @@ import uuid
 class Assistant:
     """Base class for all LLM calls"""
 
+    # Legacy rows keep their inline explanation, deduplicated rows point to mistake_explanations
+    _SELECT_MISTAKES_QUERY = """
+        SELECT
+            m.id, m.session_id, m.timestamp, m.user_input_snippet, m.correction, m.mistake_type,
+            COALESCE(e.explanation, m.explanation) AS explanation,
+            m.occurrence_count, COALESCE(m.last_seen, m.timestamp) AS last_seen
+        FROM mistakes m
+        LEFT JOIN mistake_explanations e ON e.id = m.explanation_id
+    """
+
+    # The mistakes schema only needs to be created/migrated once per process
+    _mistakes_schema_ready = False
+
     def __init__(self, session_id):
         self.client = genai.Client(api_key=settings.GEMINI_API_KEY)
         self.gemini_model = settings.GEMINI_MODEL
@@ -21,6 +35,7 @@ class Assistant:
             session_id=session_id,
             connection="sqlite:///sqlite.db"
         )
+        self._ensure_mistakes_schema()
 
     def _detect_intention(
         self, 
@@ -232,8 +247,146 @@ class Assistant:
             
         return mistakes
 
+    @staticmethod
+    def _normalize_field(value: Optional[str]) -> str:
+        """Collapse runs of whitespace and trim the ends of a field"""
+        if not value:
+            return ""
+        return " ".join(value.split())
+
+    def _mistake_content_hash(self, mistake_data: Dict) -> str:
+        """Hash the identifying fields of a mistake.
+
+        Two mistakes are the same when they only differ in whitespace, or in the case of
+        the mistake type. Case in the user input and correction is kept since letter case
+        can be the mistake itself.
+        """
+        fields = [
+            self._normalize_field(mistake_data.get("session_id")),
+            self._normalize_field(mistake_data.get("user_input_snippet")),
+            self._normalize_field(mistake_data.get("correction")),
+            self._normalize_field(mistake_data.get("mistake_type")).casefold(),
+        ]
+        # Unit separator keeps ("ab", "c") and ("a", "bc") from colliding
+        normalized = "\x1f".join(fields)
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def _ensure_mistakes_schema(cls):
+        """Create the mistakes tables and migrate databases created before deduplication"""
+        if cls._mistakes_schema_ready:
+            return
+        conn = None
+        try:
+            conn = sqlite3.connect("sqlite.db")
+            cls._create_mistakes_schema(conn.cursor())
+            conn.commit()
+            cls._mistakes_schema_ready = True
+        except sqlite3.Error as e:
+            logger.error(f"Database error while preparing mistakes schema: {e}")
+            if conn:
+                conn.rollback()
+        finally:
+            if conn:
+                conn.close()
+
+    @staticmethod
+    def _create_mistakes_schema(cursor: sqlite3.Cursor):
+        """Run the schema statements for the mistakes tables"""
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS mistake_explanations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                explanation_hash TEXT NOT NULL UNIQUE,
+                explanation TEXT NOT NULL
+            );
+        """)
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS mistakes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                user_input_snippet TEXT,
+                correction TEXT,
+                mistake_type TEXT,
+                explanation TEXT,
+                content_hash TEXT,
+                occurrence_count INTEGER NOT NULL DEFAULT 1,
+                last_seen TEXT,
+                explanation_id INTEGER REFERENCES mistake_explanations(id)
+            );
+        """)
+
+        # Older databases only have the original columns, add the new ones in place
+        cursor.execute("PRAGMA table_info(mistakes);")
+        existing_columns = {row[1] for row in cursor.fetchall()}
+        new_columns = {
+            "content_hash": "TEXT",
+            "occurrence_count": "INTEGER NOT NULL DEFAULT 1",
+            "last_seen": "TEXT",
+            "explanation_id": "INTEGER REFERENCES mistake_explanations(id)",
+        }
+        for column, column_type in new_columns.items():
+            if column not in existing_columns:
+                cursor.execute(f"ALTER TABLE mistakes ADD COLUMN {column} {column_type};")
+
+        # Legacy rows have a NULL hash, which SQLite allows multiple times in a unique index
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_mistakes_content_hash ON mistakes (content_hash);")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_mistakes_session_id ON mistakes (session_id);")
+
+    @staticmethod
+    def _get_explanation_id(cursor: sqlite3.Cursor, explanation: Optional[str]) -> Optional[int]:
+        """Store an explanation once and return its id"""
+        if not explanation:
+            return None
+        explanation_hash = hashlib.sha256(explanation.encode("utf-8")).hexdigest()
+        cursor.execute("""
+            INSERT OR IGNORE INTO mistake_explanations (explanation_hash, explanation)
+            VALUES (?, ?)
+        """, (explanation_hash, explanation))
+        cursor.execute("SELECT id FROM mistake_explanations WHERE explanation_hash = ?", (explanation_hash, ))
+        return cursor.fetchone()[0]
+
+    def _upsert_mistake(self, cursor: sqlite3.Cursor, mistake_data: Dict, timestamp_str: str):
+        """Insert a new mistake row, or bump the occurrence count of an existing one"""
+        content_hash = self._mistake_content_hash(mistake_data)
+
+        # Repeated corrections update the existing row instead of adding a new one
+        cursor.execute("""
+            INSERT INTO mistakes (
+                session_id, timestamp, user_input_snippet, correction, mistake_type,
+                content_hash, occurrence_count, last_seen
+            )
+            VALUES (?, ?, ?, ?, ?, ?, 1, ?)
+            ON CONFLICT (content_hash) DO UPDATE SET
+                occurrence_count = occurrence_count + 1,
+                last_seen = excluded.last_seen
+        """, (
+            mistake_data.get("session_id"),
+            timestamp_str,
+            mistake_data.get("user_input_snippet"),
+            mistake_data.get("correction"),
+            mistake_data.get("mistake_type"),
+            content_hash,
+            timestamp_str
+            # Add other fields if extracted
+        ))
+
+        # Read the row back in the same transaction, RETURNING needs a newer SQLite than upserts do
+        cursor.execute("SELECT id, explanation_id FROM mistakes WHERE content_hash = ?", (content_hash, ))
+        mistake_id, explanation_id = cursor.fetchone()
+
+        # Only a new mistake stores its explanation, repeats keep the first one
+        if explanation_id is None:
+            explanation_id = self._get_explanation_id(cursor, mistake_data.get("explanation"))
+            if explanation_id is not None:
+                cursor.execute(
+                    "UPDATE mistakes SET explanation_id = ? WHERE id = ?",
+                    (explanation_id, mistake_id)
+                )
+
     def _log_mistake_to_db(self, mistake_data: Dict):
-        """Insert a single mistake record in the database"""
+        """Insert a mistake record, or bump its occurrence count if it was already logged"""
         try:
             # First need to connect to the database
             conn = sqlite3.connect("sqlite.db")  
@@ -245,31 +398,14 @@ class Assistant:
             # Convert to string 
             timestamp_str = local_time.isoformat(sep=' ', timespec='seconds') # e.g., '2025-03-27 09:39:50'
 
-            # Ensure the table exists
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS mistakes (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    session_id TEXT NOT NULL,
-                    timestamp TEXT NOT NULL,
-                    user_input_snippet TEXT,
-                    correction TEXT,
-                    mistake_type TEXT,
-                    explanation TEXT 
-                );
-            """)
-
-            cursor.execute("""
-                INSERT INTO mistakes (session_id, timestamp, user_input_snippet, correction, mistake_type, explanation) 
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (
-                mistake_data.get("session_id"),
-                timestamp_str,
-                mistake_data.get("user_input_snippet"),
-                mistake_data.get("correction"),
-                mistake_data.get("mistake_type"),
-                mistake_data.get("explanation") 
-                # Add other fields if extracted
-            ))
+            try:
+                self._upsert_mistake(cursor, mistake_data, timestamp_str)
+            except sqlite3.OperationalError as e:
+                # The database may have been replaced since the schema was prepared, rebuild it and retry once
+                logger.warning(f"Mistake upsert failed, re-creating mistakes schema and retrying: {e}")
+                conn.rollback()
+                self._create_mistakes_schema(cursor)
+                self._upsert_mistake(cursor, mistake_data, timestamp_str)
 
             # Commit to database
             conn.commit()
@@ -303,6 +439,7 @@ class Assistant:
                 mistake_string += f"Correct Response - {mistake.get('correction')} | "
                 mistake_string += f"Mistake Type - {mistake.get('mistake_type')} | "
                 mistake_string += f"Explanation - {mistake.get('explanation')} | "
+                mistake_string += f"Times Made - {mistake.get('occurrence_count') or 1} | "
                 mistake_string += "`[MistakesEnd]`"
 
         return mistake_string.strip()
@@ -318,7 +455,7 @@ class Assistant:
 
             cursor = conn.cursor()
             # Query the database
-            cursor.execute("SELECT * FROM mistakes;")
+            cursor.execute(f"{self._SELECT_MISTAKES_QUERY};")
             # Fetch all results as sqlite3.Row objects
             rows = cursor.fetchall()
 
@@ -349,7 +486,7 @@ class Assistant:
             cursor = conn.cursor()
 
             # Extract row based on session_id
-            cursor.execute("SELECT * FROM mistakes WHERE session_id = ?", (session_id, ))
+            cursor.execute(f"{self._SELECT_MISTAKES_QUERY} WHERE m.session_id = ?", (session_id, ))
             # Fetch all results 
             rows = cursor.fetchall()
 